@@ -3,94 +3,93 @@ Extract local unit types from the IFRC GO API (production & staging)
 and output counts to an Excel file suitable for waffle chart visualization.
 """
 
+import asyncio
+import logging
 import os
-import requests
+import httpx
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
 from collections import Counter
+from collections.abc import AsyncIterator
+
+from ifrc_client import iter_pages, process_environments
 
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
-load_dotenv()
-TOKEN = os.getenv("IFRC_GO_TOKEN")
-
-HEADERS = {"Authorization": f"Token {TOKEN}"}
-LIMIT = 50  # records per page
-
-ENVIRONMENTS = {
-    "production": "https://goadmin.ifrc.org/api/v2/local-units/",
-    "staging": "https://goadmin-stage.ifrc.org/api/v2/local-units/",
-}
-
 OUTPUT_FILE = "local_units_summary.xlsx"
+CSV_OUTPUT_FILE = "local_units_summary.csv"
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
-def fetch_all_local_units(base_url: str) -> list[dict]:
-    """Paginate through all local units using offset & limit."""
-    all_results = []
-    offset = 0
-
-    while True:
-        params = {"limit": LIMIT, "offset": offset}
-        print(f"  Fetching {base_url}  offset={offset} ...")
-        resp = requests.get(base_url, headers=HEADERS, params=params, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-
-        results = data.get("results", [])
-        all_results.extend(results)
-
-        total = data.get("count", 0)
-        offset += LIMIT
-
-        print(f"    Got {len(results)} records (total so far: {len(all_results)}/{total})")
-
-        # Stop when we've retrieved all records
-        if offset >= total or len(results) == 0:
-            break
-
-    return all_results
-
+def get_type_name(record: dict) -> str:
+    """Return the local-unit type name from type_details.name."""
+    type_details = record.get("type_details")
+    # One lookup per key; an absent, null or empty name all count as unknown
+    name = type_details.get("name") if type_details else None
+    return name or "Unknown / No Type"
+
+
+async def count_types(pages: AsyncIterator[list[dict]]) -> Counter:
+    """Count occurrences of each local-unit type from type_details.name,
+    gathering the names page by page as results arrive."""
+    names = []
+    async for records in pages:
+        names.extend(map(get_type_name, records))
+
+    # Counter's constructor counts in C, unlike a `counter[name] += 1` loop
+    return Counter(names)
+
+
+async def process_env(
+    client: httpx.AsyncClient, env_name: str, urls: dict
+) -> tuple[Counter | None, list[str]]:
+    """Fetch and count local-unit types for a single environment.
+
+    Returns the counts (or None on failure) together with the report lines to
+    print; these are buffered so that concurrently processed environments
+    don't interleave their output.
+    """
+    base_url = urls["local_units"]
+    report = [f"\n{'='*60}", f"Fetching from {env_name.upper()} ({base_url})", f"{'='*60}"]
+    try:
+        counts = await count_types(
+            iter_pages(client, base_url, fields="type_details", label=f"{env_name}/Local Units")
+        )
+        report.append(f"  Total records: {sum(counts.values())}")
+        report.append(f"  Types found: {dict(counts)}")
+        return counts, report
+    except httpx.TransportError as e:
+        report.append(f"\n  ⚠️  WARNING: Could not reach {env_name} ({base_url})")
+        report.append(f"     The server may be on an internal network or VPN.")
+        report.append(f"     Skipping {env_name} and continuing...\n")
+    except httpx.HTTPStatusError as e:
+        report.append(f"\n  ⚠️  WARNING: HTTP error from {env_name}: {e}")
+        report.append(f"     Skipping {env_name} and continuing...\n")
+    return None, report
+
+
+async def collect_env_counts() -> dict[str, Counter]:
+    """Fetch and count local-unit types for every environment concurrently,
+    keeping the counts of those that are reachable."""
+    results = await process_environments(process_env)
 
-def count_types(records: list[dict]) -> Counter:
-    """Count occurrences of each local-unit type from type_details.name."""
-    counter = Counter()
-    for record in records:
-        type_details = record.get("type_details")
-        if type_details and type_details.get("name"):
-            counter[type_details["name"]] += 1
-        else:
-            counter["Unknown / No Type"] += 1
-    return counter
+    env_counts = {}
+    for env_name, (counts, report) in results.items():
+        print("\n".join(report))
+        if counts is not None:
+            env_counts[env_name] = counts
+    return env_counts
 
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 def main():
-    env_counts = {}
-
-    for env_name, base_url in ENVIRONMENTS.items():
-        print(f"\n{'='*60}")
-        print(f"Fetching from {env_name.upper()} ({base_url})")
-        print(f"{'='*60}")
-        try:
-            records = fetch_all_local_units(base_url)
-            counts = count_types(records)
-            env_counts[env_name] = counts
-            print(f"  Total records: {sum(counts.values())}")
-            print(f"  Types found: {dict(counts)}")
-        except requests.exceptions.ConnectionError as e:
-            print(f"\n  ⚠️  WARNING: Could not reach {env_name} ({base_url})")
-            print(f"     The server may be on an internal network or VPN.")
-            print(f"     Skipping {env_name} and continuing...\n")
-        except requests.exceptions.HTTPError as e:
-            print(f"\n  ⚠️  WARNING: HTTP error from {env_name}: {e}")
-            print(f"     Skipping {env_name} and continuing...\n")
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    env_counts = asyncio.run(collect_env_counts())
 
     if not env_counts:
         print("\n❌ Could not fetch data from any environment. Exiting.")
@@ -99,37 +98,35 @@ def main():
     # Merge all type names from all reachable environments
     all_types = sorted(set().union(*[c.keys() for c in env_counts.values()]))
 
-    # Build the DataFrame — include columns only for reachable environments
-    rows = []
-    for type_name in all_types:
-        row = {"categories": type_name}
-        for env_name in ENVIRONMENTS:
-            if env_name in env_counts:
-                row[f"count_{env_name}"] = env_counts[env_name].get(type_name, 0)
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
-
-    # Add percentage and waffle-cell columns for each reachable environment
-    for env_name in env_counts:
-        count_col = f"count_{env_name}"
-        total = df[count_col].sum()
-
-        # Percentage of total (useful for waffle chart sizing)
-        df[f"pct_{env_name}"] = (
-            (df[count_col] / total * 100).round(2) if total else 0
-        )
-
-        # Waffle cells: a 10×10 grid = 100 cells, each cell ≈ 1%
-        df[f"waffle_cells_{env_name}"] = (
-            (df[count_col] / total * 100).round(0).astype(int)
-            if total
-            else 0
-        )
-
-    # Save to Excel
-    df.to_excel(OUTPUT_FILE, index=False, sheet_name="Local Unit Types")
-    print(f"\n✅ Saved to {OUTPUT_FILE}")
+    # Build the DataFrame column by column — only for reachable environments
+    df = pd.DataFrame({
+        "categories": all_types,
+        **{
+            f"count_{env_name}": [counts.get(type_name, 0) for type_name in all_types]
+            for env_name, counts in env_counts.items()
+        },
+    })
+
+    # Percentage of total (useful for waffle chart sizing), computed for all
+    # environments in one pass over the count matrix; an environment with no
+    # records gets 0% everywhere
+    counts = df[[f"count_{env_name}" for env_name in env_counts]].to_numpy(dtype=np.float64)
+    totals = counts.sum(axis=0, keepdims=True)
+    totals[totals == 0] = 1
+    pct = counts / totals * 100
+
+    # Waffle cells: a 10×10 grid = 100 cells, each cell ≈ 1%
+    pct_rounded = pct.round(2)
+    waffle_cells = pct.round(0).astype(np.int32)
+
+    for i, env_name in enumerate(env_counts):
+        df[f"pct_{env_name}"] = pct_rounded[:, i]
+        df[f"waffle_cells_{env_name}"] = waffle_cells[:, i]
+
+    # Save to Excel, plus a CSV copy for consumers that don't need a workbook
+    df.to_excel(OUTPUT_FILE, index=False, sheet_name="Local Unit Types", engine="xlsxwriter")
+    df.to_csv(CSV_OUTPUT_FILE, index=False)
+    print(f"\n✅ Saved to {OUTPUT_FILE} and {CSV_OUTPUT_FILE}")
     print(df.to_string(index=False))
 
 
@@ -11,31 +11,22 @@ Region mapping is derived from the /api/v2/country/ endpoint:
   region 4 = MENA
 """
 
+import asyncio
+import json
+import logging
 import os
-import requests
+import tempfile
+import time
+import httpx
 import pandas as pd
-from dotenv import load_dotenv
 from collections import Counter
 
+from ifrc_client import fetch_all, gather_or_cancel, process_environments
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
-load_dotenv()
-TOKEN = os.getenv("IFRC_GO_TOKEN")
-
-HEADERS = {"Authorization": f"Token {TOKEN}"}
-LIMIT = 50  # records per page
-
-ENVIRONMENTS = {
-    "production": {
-        "local_units": "https://goadmin.ifrc.org/api/v2/local-units/",
-        "country": "https://goadmin.ifrc.org/api/v2/country/",
-    },
-    "staging": {
-        "local_units": "https://goadmin-stage.ifrc.org/api/v2/local-units/",
-        "country": "https://goadmin-stage.ifrc.org/api/v2/country/",
-    },
-}
+logger = logging.getLogger(__name__)
 
 REGION_MAP = {
     0: "Africa",
@@ -46,37 +37,15 @@ REGION_MAP = {
 }
 
 OUTPUT_FILE = "local_units_treemap.xlsx"
+CSV_OUTPUT_FILE = "local_units_treemap_{env_name}.csv"  # one per environment
+
+CACHE_DIR = ".cache"
+COUNTRY_MAP_TTL = 24 * 60 * 60  # seconds before the cached region mapping is refreshed
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
-def fetch_paginated(base_url: str, label: str = "") -> list[dict]:
-    """Paginate through all records using offset & limit."""
-    all_results = []
-    offset = 0
-
-    while True:
-        params = {"limit": LIMIT, "offset": offset}
-        print(f"  [{label}] Fetching offset={offset} ...")
-        resp = requests.get(base_url, headers=HEADERS, params=params, timeout=60)
-        resp.raise_for_status()
-        data = resp.json()
-
-        results = data.get("results", [])
-        all_results.extend(results)
-
-        total = data.get("count", 0)
-        offset += LIMIT
-
-        print(f"    Got {len(results)} records (total so far: {len(all_results)}/{total})")
-
-        if offset >= total or len(results) == 0:
-            break
-
-    return all_results
-
-
 def build_country_to_region(countries: list[dict]) -> dict[int, str]:
     """Build a mapping from country ID → region name."""
     mapping = {}
@@ -88,32 +57,82 @@ def build_country_to_region(countries: list[dict]) -> dict[int, str]:
     return mapping
 
 
-def process_environment(env_name: str, urls: dict) -> pd.DataFrame | None:
-    """Fetch and process data for a single environment. Returns a DataFrame or None on failure."""
+async def load_country_map(
+    client: httpx.AsyncClient, env_name: str, urls: dict
+) -> dict[int, str]:
+    """Return the country ID → region mapping for an environment.
+
+    The mapping is read from CACHE_DIR when the cached copy is younger than
+    COUNTRY_MAP_TTL; otherwise it is rebuilt from the country endpoint and
+    written back to the cache.
+    """
+    cache_file = os.path.join(CACHE_DIR, f"country_map_{env_name}.json")
+    if (
+        os.path.exists(cache_file)
+        and time.time() - os.path.getmtime(cache_file) < COUNTRY_MAP_TTL
+    ):
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                # JSON object keys are always strings
+                cached = {int(country_id): region for country_id, region in json.load(f).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            # A truncated or otherwise corrupt cache is just a cache miss
+            logger.warning("  [%s] Ignoring unreadable cache %s: %s", env_name, cache_file, e)
+        else:
+            logger.info("  [%s] Using cached country data from %s", env_name, cache_file)
+            return cached
+
+    countries = await fetch_all(
+        client, urls["country"], fields="id,region", label=f"{env_name}/Countries"
+    )
+    country_to_region = build_country_to_region(countries)
+
+    # Write to a temporary file and swap it in, so an interrupted run never
+    # leaves a partial cache behind
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=CACHE_DIR, suffix=".tmp", delete=False
+    ) as f:
+        json.dump(country_to_region, f)
+    os.replace(f.name, cache_file)
+    return country_to_region
+
+
+async def process_environment(
+    client: httpx.AsyncClient, env_name: str, urls: dict
+) -> tuple[pd.DataFrame | None, list[str]]:
+    """Fetch and process data for a single environment.
+
+    Returns a DataFrame (or None on failure) together with the report lines to
+    print; these are buffered so that concurrently processed environments
+    don't interleave their output.
+    """
+    report = []
     try:
-        # Step 1: Fetch countries for region mapping
-        print(f"\n  Fetching country data for region mapping ...")
-        countries = fetch_paginated(urls["country"], label=f"{env_name}/Countries")
-        country_to_region = build_country_to_region(countries)
-        print(f"  Mapped {len(country_to_region)} countries to regions\n")
-
-        # Step 2: Fetch all local units
-        print(f"  Fetching all local units ...")
-        local_units = fetch_paginated(urls["local_units"], label=f"{env_name}/Local Units")
-        print(f"  Total local units: {len(local_units)}\n")
+        # Step 1 & 2: Fetch countries (for region mapping) and local units concurrently
+        report.append(f"\n  Fetching country data and local units ...")
+        # If either fetch fails, the other is cancelled rather than left running
+        country_to_region, local_units = await gather_or_cancel(
+            load_country_map(client, env_name, urls),
+            fetch_all(
+                client,
+                urls["local_units"],
+                fields="type_details,country",
+                label=f"{env_name}/Local Units",
+            ),
+        )
+        report.append(f"\n  Mapped {len(country_to_region)} countries to regions")
+        report.append(f"  Total local units: {len(local_units)}\n")
 
         # Step 3: Count by (type, region)
         type_region_counter = Counter()
         unresolved_countries = set()
 
         for unit in local_units:
-            # Get the type name
+            # Get the type name (one lookup per key; an absent, null or empty
+            # name all count as unknown)
             type_details = unit.get("type_details")
-            type_name = (
-                type_details["name"]
-                if type_details and type_details.get("name")
-                else "Unknown Type"
-            )
+            type_name = (type_details.get("name") if type_details else None) or "Unknown Type"
 
             # Get the country ID and resolve to region
             country_id = unit.get("country")
@@ -126,61 +145,74 @@ def process_environment(env_name: str, urls: dict) -> pd.DataFrame | None:
             type_region_counter[(type_name, region_name)] += 1
 
         if unresolved_countries:
-            print(f"  ⚠️  {len(unresolved_countries)} country IDs could not be mapped: {unresolved_countries}")
-
-        # Build DataFrame
-        rows = []
-        for (type_name, region_name), count in sorted(type_region_counter.items()):
-            rows.append({
-                "categories": type_name,
-                "Region": region_name,
-                "count": count,
-            })
-
-        df = pd.DataFrame(rows)
-        df = df.sort_values(["categories", "Region"]).reset_index(drop=True)
-        return df
-
-    except requests.exceptions.ConnectionError:
-        print(f"\n  ⚠️  WARNING: Could not reach {env_name}")
-        print(f"     The server may be on an internal network or VPN.")
-        print(f"     Skipping {env_name} and continuing...\n")
-        return None
-    except requests.exceptions.HTTPError as e:
-        print(f"\n  ⚠️  WARNING: HTTP error from {env_name}: {e}")
-        print(f"     Skipping {env_name} and continuing...\n")
-        return None
-
+            report.append(f"  ⚠️  {len(unresolved_countries)} country IDs could not be mapped: {unresolved_countries}")
+
+        # Build DataFrame straight from the counter and sort it once
+        df = pd.DataFrame(
+            [
+                (type_name, region_name, count)
+                for (type_name, region_name), count in type_region_counter.items()
+            ],
+            columns=["categories", "Region", "count"],
+        )
+        return df.sort_values(["categories", "Region"], ignore_index=True), report
+
+    except httpx.TransportError:
+        report.append(f"\n  ⚠️  WARNING: Could not reach {env_name}")
+        report.append(f"     The server may be on an internal network or VPN.")
+        report.append(f"     Skipping {env_name} and continuing...\n")
+        return None, report
+    except httpx.HTTPStatusError as e:
+        report.append(f"\n  ⚠️  WARNING: HTTP error from {env_name}: {e}")
+        report.append(f"     Skipping {env_name} and continuing...\n")
+        return None, report
+
+
+async def collect_sheets() -> dict[str, pd.DataFrame]:
+    """Process every environment concurrently, keeping the DataFrames of those
+    that succeed."""
+    results = await process_environments(process_environment)
 
-# ---------------------------------------------------------------------------
-# Main
-# ---------------------------------------------------------------------------
-def main():
     all_sheets = {}
-
-    for env_name, urls in ENVIRONMENTS.items():
+    for env_name, (df, report) in results.items():
         print(f"\n{'='*60}")
         print(f"Processing {env_name.upper()}")
         print(f"{'='*60}")
+        print("\n".join(report))
 
-        df = process_environment(env_name, urls)
         if df is not None:
             all_sheets[env_name] = df
             print(f"\n  ✅ {env_name}: {len(df)} rows (type × region combinations)")
             print(df.to_string(index=False))
 
+    return all_sheets
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def main():
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    all_sheets = asyncio.run(collect_sheets())
+
     if not all_sheets:
         print("\n❌ Could not fetch data from any environment. Exiting.")
         return
 
     # Save each environment to a separate sheet in the same Excel file
-    with pd.ExcelWriter(OUTPUT_FILE, engine="openpyxl") as writer:
+    with pd.ExcelWriter(OUTPUT_FILE, engine="xlsxwriter") as writer:
         for env_name, df in all_sheets.items():
             sheet_name = env_name.capitalize()
             df.to_excel(writer, index=False, sheet_name=sheet_name)
 
     print(f"\n✅ Saved to {OUTPUT_FILE} ({', '.join(all_sheets.keys())} sheets)")
 
+    # Plain CSV copies for consumers that don't need a workbook
+    for env_name, df in all_sheets.items():
+        csv_file = CSV_OUTPUT_FILE.format(env_name=env_name)
+        df.to_csv(csv_file, index=False)
+        print(f"✅ Saved to {csv_file}")
+
 
 if __name__ == "__main__":
     main()
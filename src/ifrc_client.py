@@ -0,0 +1,289 @@
+"""
+Shared client for the IFRC GO API: configuration, the HTTP/2 client and
+concurrent pagination used by the local-unit extraction scripts.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import httpx
+import orjson
+from dotenv import load_dotenv
+from collections.abc import AsyncIterator, Awaitable, Callable
+from email.utils import parsedate_to_datetime
+from typing import TypeVar
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO; per-request output belongs at DEBUG here
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+load_dotenv()
+TOKEN = os.getenv("IFRC_GO_TOKEN")
+
+HEADERS = {"Authorization": f"Token {TOKEN}", "Accept-Encoding": "gzip, deflate"}
+LIMIT = 1000  # records per page requested
+MAX_PAGE_PROBE = [LIMIT, 500, 200, 100, 50]  # page sizes tried in order if the server rejects one
+PROGRESS_EVERY = 10  # pages between progress lines at INFO level
+CONCURRENCY = 8  # max in-flight page requests per endpoint
+CONNECTION_LIMIT = 16  # max open connections per client (HTTP/2 multiplexes over one)
+KEEPALIVE_TIMEOUT = 60  # seconds an idle connection is kept for reuse
+RETRY_TOTAL = 3  # retries for transient failures
+RETRY_BACKOFF = 0.3  # seconds, doubled after every retry
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_AFTER_STATUSES = {429, 503}  # statuses whose Retry-After header is honoured
+
+ENVIRONMENTS = {
+    "production": {
+        "local_units": "https://goadmin.ifrc.org/api/v2/local-units/",
+        "country": "https://goadmin.ifrc.org/api/v2/country/",
+    },
+    "staging": {
+        "local_units": "https://goadmin-stage.ifrc.org/api/v2/local-units/",
+        "country": "https://goadmin-stage.ifrc.org/api/v2/country/",
+    },
+}
+
+T = TypeVar("T")
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+async def gather_or_cancel(*aws: Awaitable[T]) -> list[T]:
+    """Like asyncio.gather, but if any awaitable fails the others are
+    cancelled and awaited before the exception propagates, so no request is
+    left running in the background."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def create_client() -> httpx.AsyncClient:
+    """Create the HTTP/2 client shared by all requests in a run, so that
+    concurrent page requests to a host multiplex over a single connection."""
+    return httpx.AsyncClient(
+        http2=True,
+        headers=HEADERS,
+        limits=httpx.Limits(
+            max_connections=CONNECTION_LIMIT,
+            max_keepalive_connections=CONNECTION_LIMIT,
+            keepalive_expiry=KEEPALIVE_TIMEOUT,
+        ),
+        timeout=60,
+        # e.g. http:// `next` links from a DRF server behind a TLS proxy
+        follow_redirects=True,
+    )
+
+
+def retry_delay(resp: httpx.Response | None, attempt: int) -> float:
+    """Seconds to wait before retrying: the server's Retry-After header on a
+    429/503 response if it sent one, otherwise exponential backoff."""
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and resp.status_code in RETRY_AFTER_STATUSES:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            # Retry-After may also be an HTTP date
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return RETRY_BACKOFF * 2**attempt
+
+
+async def get_body(
+    client: httpx.AsyncClient, url: str, params: dict | None = None
+) -> bytes:
+    """GET `url` and return the raw response body, retrying connection
+    errors, timeouts and transient statuses like urllib3's Retry does."""
+    for attempt in range(RETRY_TOTAL + 1):
+        last_attempt = attempt == RETRY_TOTAL
+        resp = None
+        try:
+            resp = await client.get(url, params=params)
+        except httpx.TransportError:
+            # Connect errors, timeouts and connections dropped under us
+            if last_attempt:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES or last_attempt:
+                resp.raise_for_status()
+                return resp.content
+        await asyncio.sleep(retry_delay(resp, attempt))
+
+
+async def fetch_page(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    base_url: str,
+    offset: int,
+    limit: int = LIMIT,
+    fields: str | None = None,
+    label: str = "",
+) -> dict:
+    """Fetch a single page of results starting at `offset`."""
+    params = {"limit": limit, "offset": offset}
+    if fields:
+        params["fields"] = fields
+    async with semaphore:
+        logger.debug("  [%s] Fetching offset=%d ...", label, offset)
+        data = orjson.loads(await get_body(client, base_url, params))
+
+    # Per-page output is DEBUG; only every PROGRESS_EVERY-th page shows at INFO
+    log = logger.info if (offset // limit) % PROGRESS_EVERY == 0 else logger.debug
+    log("    [%s] Got %d records (offset=%d)", label, len(data.get("results", [])), offset)
+    return data
+
+
+async def probe_fields(
+    client: httpx.AsyncClient, base_url: str, fields: str
+) -> str | None:
+    """Return `fields` if the server honours it as a sparse fieldset, else None.
+
+    The same small page is requested with and without the parameter. It is
+    only kept if the server accepts it, it actually makes the response
+    smaller, and every returned record still has each requested key.
+    """
+    params = {"limit": MAX_PAGE_PROBE[-1], "offset": 0}
+
+    async def get_sparse() -> bytes | None:
+        try:
+            return await get_body(client, base_url, {**params, "fields": fields})
+        except httpx.HTTPStatusError:
+            # Rejecting the parameter just means it isn't supported
+            return None
+
+    full, sparse = await gather_or_cancel(get_body(client, base_url, params), get_sparse())
+    if sparse is None or len(sparse) >= len(full):
+        return None
+
+    # A smaller body is not enough: a server could drop keys we rely on
+    keys = fields.split(",")
+    records = orjson.loads(sparse).get("results", [])
+    if not all(key in record for record in records for key in keys):
+        return None
+    return fields
+
+
+async def fetch_first_page(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    base_url: str,
+    fields: str | None = None,
+    label: str = "",
+) -> tuple[dict, int]:
+    """Fetch the first page and work out the page size to use for the rest.
+
+    Page sizes from MAX_PAGE_PROBE are tried in order while the server
+    rejects them with a 4xx response. If the server instead clamps the page,
+    the number of results it actually returned becomes the page size.
+    """
+    for limit in MAX_PAGE_PROBE:
+        try:
+            data = await fetch_page(client, semaphore, base_url, 0, limit, fields, label)
+            break
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            # Auth / not-found errors won't be fixed by asking for fewer records
+            if not 400 <= status < 500 or status in (401, 403, 404):
+                raise
+            if limit == MAX_PAGE_PROBE[-1]:
+                raise
+            logger.warning(
+                "    [%s] Page size %d rejected (%d), retrying with a smaller page ...",
+                label, limit, status,
+            )
+
+    # A server that caps `limit` silently returns a short first page
+    returned = len(data.get("results", []))
+    if 0 < returned < limit and returned < (data.get("count") or 0):
+        limit = returned
+    return data, limit
+
+
+async def iter_pages(
+    client: httpx.AsyncClient,
+    base_url: str,
+    fields: str | None = None,
+    label: str = "",
+) -> AsyncIterator[list[dict]]:
+    """Yield pages of records as they arrive.
+
+    The first page reports the total count and the effective page size;
+    every remaining page is then requested concurrently and yielded in
+    completion order, so callers can process one page while the others are
+    still in flight. If the count is missing, or was stale and the last page
+    still links to a `next` one, the remaining pages are fetched by following
+    those links. `fields` optionally restricts the returned record fields
+    (see probe_fields).
+    """
+    if fields:
+        fields = await probe_fields(client, base_url, fields)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    data, page_size = await fetch_first_page(client, semaphore, base_url, fields, label)
+    total = data.get("count") or 0
+
+    # Every remaining offset is known upfront, so request them all at once
+    tasks = {
+        offset: asyncio.create_task(
+            fetch_page(client, semaphore, base_url, offset, page_size, fields, label)
+        )
+        for offset in range(page_size, total, page_size)
+    }
+    try:
+        yield data.get("results", [])
+        for next_page in asyncio.as_completed(tasks.values()):
+            yield (await next_page).get("results", [])
+
+        # The `next` URL already carries limit, offset and fields
+        last_page = tasks[max(tasks)].result() if tasks else data
+        next_url = last_page.get("next") if last_page.get("results") else None
+        while next_url:
+            logger.debug("  [%s] Following next link %s ...", label, next_url)
+            data = orjson.loads(await get_body(client, next_url))
+            results = data.get("results", [])
+            yield results
+            next_url = data.get("next") if results else None
+    finally:
+        # Don't leave requests running if the caller stops early or a page fails
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+
+async def fetch_all(
+    client: httpx.AsyncClient,
+    base_url: str,
+    fields: str | None = None,
+    label: str = "",
+) -> list[dict]:
+    """Collect every page of records into a single list."""
+    all_results = []
+    async for results in iter_pages(client, base_url, fields, label):
+        all_results.extend(results)
+    return all_results
+
+
+async def process_environments(
+    process: Callable[[httpx.AsyncClient, str, dict], Awaitable[T]],
+) -> dict[str, T]:
+    """Run `process(client, env_name, urls)` for every environment
+    concurrently on one shared client.
+
+    Results are keyed by environment name, in ENVIRONMENTS order.
+    """
+    async with create_client() as client:
+        results = await gather_or_cancel(
+            *(process(client, env_name, urls) for env_name, urls in ENVIRONMENTS.items())
+        )
+    return dict(zip(ENVIRONMENTS, results))